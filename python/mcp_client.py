@@ -9,11 +9,31 @@ import socket
 import json
 import time
 import uuid
+import itertools
 import logging
 import threading
+import queue
+import selectors
 import sys
+from concurrent.futures import Future, InvalidStateError, TimeoutError as FutureTimeoutError
 from typing import Dict, List, Any, Union, Tuple, Optional, Callable
 
+# Use orjson for message (de)serialization when available; it encodes straight
+# to bytes. The fallback decoder is built once rather than on every json.loads
+try:
+    import orjson
+    _dumps = orjson.dumps
+    _loads = orjson.loads
+except ImportError:
+    orjson = None
+    _loads = json.JSONDecoder().decode
+
+    # Compact separators and raw UTF-8 match what orjson puts on the wire
+    _ENC = json.JSONEncoder(separators=(',', ':'), ensure_ascii=False).encode
+
+    def _dumps(obj: Any) -> bytes:
+        return _ENC(obj).encode('utf-8')
+
 # Configure logging
 logging.basicConfig(
     level=logging.INFO,
@@ -25,6 +45,10 @@ logging.basicConfig(
 )
 logger = logging.getLogger('MCPClient')
 
+# Receive buffer size; large enough that bulk responses such as get_history
+# arrive in a few reads
+RECV_BUFFER_SIZE = 1 << 16
+
 class MCPClient:
     """
     Client for connecting to the MCP Server and sending commands to MetaTrader 5
@@ -45,13 +69,22 @@ class MCPClient:
         self.socket = None
         self.connected = False
         self.authenticated = False
-        self.receive_thread = None
+        self.io_thread = None
+        self._send_queue = None  # Outbound messages for the I/O thread
+        self._wakeup_socket = None  # Written to wake the I/O thread for sends
+        self._wakeup_pending = False
         self.running = False
         self.callbacks = {}  # Callbacks for request IDs
         self.default_callback = None  # Default callback for all responses
         self.response_lock = threading.Lock()
-        self.response_event = threading.Event()
-        self.last_response = None
+        self._pending = {}  # Futures for synchronous requests, keyed by request ID
+        self._auth_future = None  # Future for the pending authentication response
+        
+        # Request IDs are a per-client prefix plus a counter; the server keys
+        # pending responses by request ID, so the prefix keeps IDs from
+        # different clients apart
+        self._request_id_prefix = uuid.uuid4().hex[:12]
+        self._request_counter = itertools.count(1)
         
         logger.info(f"MCP Client initialized with host={host}, port={port}")
         
@@ -69,24 +102,118 @@ class MCPClient:
             logger.warning("Already connected to MCP Server")
             return True
             
+        if not self._open_connection(timeout):
+            return False
+            
+        # Authenticate if token provided
+        if self.auth_token:
+            return self.authenticate()
+            
+        return True
+        
+    def connect_and_send(self, command: str, parameters: Dict[str, Any] = None,
+                         timeout: int = 30, connect_timeout: int = 10) -> Dict[str, Any]:
+        """
+        Connect to the MCP Server and send a first command without waiting
+        for the authentication round trip
+        
+        The authentication request and the command are written together in
+        a single send; the server handles them in order on the connection.
+        
+        Args:
+            command: Command name
+            parameters: Command parameters
+            timeout: Timeout for the command response in seconds
+            connect_timeout: Connection timeout in seconds
+            
+        Returns:
+            Response data dictionary
+        """
+        if self.connected:
+            return self.send_command(command, parameters, timeout=timeout)
+            
+        if not self._open_connection(connect_timeout):
+            return {'status': 'error', 'message': 'Not connected to MCP Server'}
+            
+        if not self.auth_token:
+            return self.send_command(command, parameters, timeout=timeout)
+            
+        request_id = self._next_request_id()
+        auth_future = Future()
+        future = Future()
+        self._auth_future = auth_future
+        self._pending[request_id] = future
+        
+        try:
+            # Send authentication request and command in one write
+            self._send_frame(_dumps({'auth': self.auth_token}) + b'\n' + _dumps({
+                'command': command,
+                'requestId': request_id,
+                'parameters': parameters or {}
+            }) + b'\n')
+            logger.debug("Command '%s' sent with request ID %s after authentication", command, request_id)
+            
+            # Wait for authentication response
+            try:
+                auth_response = auth_future.result(timeout=connect_timeout)
+            except FutureTimeoutError:
+                logger.error("Authentication timeout")
+                return {'status': 'error', 'message': 'Authentication timeout'}
+                
+            if not self._check_auth_response(auth_response):
+                return {'status': 'error', 'message': 'Not authenticated with MCP Server'}
+                
+            # Wait for command response
+            try:
+                return future.result(timeout=timeout)
+            except FutureTimeoutError:
+                logger.warning(f"Timeout waiting for response to command '{command}'")
+                return {'status': 'error', 'message': 'Response timeout'}
+                
+        except Exception as e:
+            logger.error(f"Error sending command '{command}': {str(e)}")
+            return {'status': 'error', 'message': str(e)}
+            
+        finally:
+            self._auth_future = None
+            self._pending.pop(request_id, None)
+            
+    def _open_connection(self, timeout: int) -> bool:
+        """
+        Open the socket to the MCP Server and start the I/O thread
+        
+        Args:
+            timeout: Connection timeout in seconds
+            
+        Returns:
+            True if connection successful, False otherwise
+        """
         try:
             self.socket = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
             self.socket.settimeout(timeout)
             self.socket.connect((self.host, self.port))
+
+            # Commands are small request/response messages, so disable Nagle
+            # to avoid delaying each send waiting for the previous ACK
+            self.socket.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+            self.socket.setsockopt(socket.SOL_SOCKET, socket.SO_SNDBUF, 1 << 17)
+            self.socket.setsockopt(socket.SOL_SOCKET, socket.SO_RCVBUF, 1 << 17)
+            self.socket.setblocking(False)
+
             self.connected = True
             self.running = True
             
-            # Start receive thread
-            self.receive_thread = threading.Thread(target=self._receive_messages)
-            self.receive_thread.daemon = True
-            self.receive_thread.start()
+            # Start I/O thread
+            self._send_queue = queue.SimpleQueue()
+            wakeup_reader, self._wakeup_socket = socket.socketpair()
+            wakeup_reader.setblocking(False)
+            self._wakeup_socket.setblocking(False)
+            self._wakeup_pending = False
+            self.io_thread = threading.Thread(target=self._run_io_loop, args=(wakeup_reader,))
+            self.io_thread.daemon = True
+            self.io_thread.start()
             
             logger.info(f"Connected to MCP Server at {self.host}:{self.port}")
-            
-            # Authenticate if token provided
-            if self.auth_token:
-                return self.authenticate()
-            
             return True
             
         except Exception as e:
@@ -102,6 +229,22 @@ class MCPClient:
         self.connected = False
         self.authenticated = False
         
+        # Wake the I/O thread so it exits
+        self._send_queue = None
+        if self._wakeup_socket is not None:
+            try:
+                self._wakeup_socket.send(b'\0')
+            except OSError:
+                pass
+            self._wakeup_socket = None
+            
+        # Fail any synchronous requests still waiting for a response
+        for future in list(self._pending.values()):
+            try:
+                future.set_result({'status': 'error', 'message': 'Disconnected from MCP Server'})
+            except InvalidStateError:
+                pass
+        
         if self.socket:
             try:
                 self.socket.close()
@@ -128,32 +271,46 @@ class MCPClient:
             
         try:
             # Send authentication request
-            auth_message = json.dumps({
+            future = Future()
+            self._auth_future = future
+            self._send_message({
                 'auth': self.auth_token
             })
             
-            self.socket.sendall(auth_message.encode('utf-8'))
-            
             # Wait for response
-            self.response_event.clear()
-            if not self.response_event.wait(timeout=10):
+            try:
+                response = future.result(timeout=10)
+            except FutureTimeoutError:
                 logger.error("Authentication timeout")
                 return False
                 
-            # Check response
-            response = self.last_response
-            if response and response.get('status') == 'authenticated':
-                self.authenticated = True
-                logger.info("Authentication successful")
-                return True
-            else:
-                logger.error(f"Authentication failed: {response.get('message', 'Unknown error')}")
-                return False
+            return self._check_auth_response(response)
                 
         except Exception as e:
             logger.error(f"Error during authentication: {str(e)}")
             return False
             
+        finally:
+            self._auth_future = None
+            
+    def _check_auth_response(self, response: Dict[str, Any]) -> bool:
+        """
+        Check the server's reply to an authentication request
+        
+        Args:
+            response: Authentication response data
+            
+        Returns:
+            True if authentication successful, False otherwise
+        """
+        if response.get('status') == 'authenticated':
+            self.authenticated = True
+            logger.info("Authentication successful")
+            return True
+        else:
+            logger.error(f"Authentication failed: {response.get('message', 'Unknown error')}")
+            return False
+            
     def send_command(self, command: str, parameters: Dict[str, Any] = None, 
                      callback: Optional[Callable] = None, timeout: int = 30) -> Dict[str, Any]:
         """
@@ -177,7 +334,7 @@ class MCPClient:
             return {'status': 'error', 'message': 'Not authenticated with MCP Server'}
             
         # Generate request ID
-        request_id = str(uuid.uuid4())
+        request_id = self._next_request_id()
         
         # Prepare command message
         message = {
@@ -186,10 +343,6 @@ class MCPClient:
             'parameters': parameters or {}
         }
         
-        # Add auth token if available
-        if self.auth_token:
-            message['auth'] = self.auth_token
-            
         try:
             # Register callback if provided
             if callback:
@@ -197,77 +350,166 @@ class MCPClient:
                     self.callbacks[request_id] = callback
                 
                 # Send message
-                self.socket.sendall(json.dumps(message).encode('utf-8'))
-                logger.debug(f"Command '{command}' sent with request ID {request_id} (async)")
+                self._send_message(message)
+                logger.debug("Command '%s' sent with request ID %s (async)", command, request_id)
                 
                 # Return request ID for async tracking
                 return {'status': 'sent', 'requestId': request_id}
                 
             else:
-                # For synchronous calls, set up response waiting
-                self.response_event.clear()
-                
-                # Clear previous response
-                self.last_response = None
-                
-                # Register temporary callback
-                with self.response_lock:
-                    self.callbacks[request_id] = self._sync_response_callback
+                # For synchronous calls, register a future for this request
+                future = Future()
+                self._pending[request_id] = future
                 
                 # Send message
-                self.socket.sendall(json.dumps(message).encode('utf-8'))
-                logger.debug(f"Command '{command}' sent with request ID {request_id} (sync)")
+                self._send_message(message)
+                logger.debug("Command '%s' sent with request ID %s (sync)", command, request_id)
                 
                 # Wait for response with timeout
-                if not self.response_event.wait(timeout=timeout):
+                try:
+                    return future.result(timeout=timeout)
+                except FutureTimeoutError:
                     logger.warning(f"Timeout waiting for response to command '{command}'")
-                    
-                    # Remove callback
-                    with self.response_lock:
-                        if request_id in self.callbacks:
-                            del self.callbacks[request_id]
-                            
                     return {'status': 'error', 'message': 'Response timeout'}
                     
-                # Return the response
-                response = self.last_response
-                if response:
-                    return response
-                else:
-                    return {'status': 'error', 'message': 'Empty response'}
-                    
         except Exception as e:
             logger.error(f"Error sending command '{command}': {str(e)}")
             return {'status': 'error', 'message': str(e)}
             
-    def _receive_messages(self) -> None:
+        finally:
+            self._pending.pop(request_id, None)
+            
+    def _next_request_id(self) -> str:
         """
-        Background thread for receiving messages from the server
+        Generate a request ID unique to this client
+        
+        Returns:
+            Request ID string
+        """
+        return f"{self._request_id_prefix}-{next(self._request_counter)}"
+        
+    def _send_message(self, message: Dict[str, Any]) -> None:
         """
-        buffer_size = 4096
+        Queue a single newline-terminated JSON message for the I/O thread
         
-        while self.running and self.socket:
+        Args:
+            message: Message dictionary
+        """
+        self._send_frame(_dumps(message) + b'\n')
+        
+    def _send_frame(self, frame: bytes) -> None:
+        """
+        Queue encoded, newline-terminated message bytes for the I/O thread
+        
+        Args:
+            frame: Encoded message bytes
+        """
+        self._send_queue.put(frame)
+        
+        # Wake the I/O thread unless a wakeup is already in flight
+        if not self._wakeup_pending:
+            self._wakeup_pending = True
             try:
-                data = self.socket.recv(buffer_size)
-                if not data:
-                    logger.warning("Server closed connection")
-                    self.disconnect()
-                    break
+                self._wakeup_socket.send(b'\0')
+            except BlockingIOError:
+                pass
+        
+    def _run_io_loop(self, wakeup_reader: socket.socket) -> None:
+        """
+        Background thread for all socket I/O with the server
+        
+        A selector waits on the server socket and on a wakeup socket that
+        _send_message writes to. Received bytes are accumulated until a full
+        newline-delimited message is available, so messages split across
+        reads or coalesced into a single read are both handled. Queued
+        outbound messages are coalesced into as few send() calls as the
+        socket allows.
+        
+        Args:
+            wakeup_reader: Read end of the wakeup socket pair
+        """
+        recv_buffer = memoryview(bytearray(RECV_BUFFER_SIZE))  # Reused for every read
+        rxbuf = bytearray()
+        txbuf = bytearray()
+        
+        # Bind loop-invariant lookups to locals
+        sock = self.socket
+        wakeup_socket = self._wakeup_socket
+        send_queue = self._send_queue
+        recv_into = sock.recv_into
+        find = rxbuf.find
+        process_response = self._process_response
+        
+        selector = selectors.DefaultSelector()
+        selector.register(sock, selectors.EVENT_READ)
+        selector.register(wakeup_reader, selectors.EVENT_READ)
+        want_write = False
+        
+        try:
+            while self.running and self.socket is sock:
+                for key, events in selector.select(timeout=1.0):
+                    if key.fileobj is wakeup_reader:
+                        # Consume the wakeup before clearing the flag, and clear
+                        # it before draining, so no queued message is missed
+                        try:
+                            wakeup_reader.recv(4096)
+                        except BlockingIOError:
+                            pass
+                        self._wakeup_pending = False
+                        while True:
+                            try:
+                                txbuf += send_queue.get_nowait()
+                            except queue.Empty:
+                                break
+                        continue
+                        
+                    if events & selectors.EVENT_READ:
+                        try:
+                            nbytes = recv_into(recv_buffer)
+                        except BlockingIOError:
+                            continue
+                        if not nbytes:
+                            logger.warning("Server closed connection")
+                            self.disconnect()
+                            return
+                            
+                        # Process every complete message in the buffer
+                        rxbuf.extend(recv_buffer[:nbytes])
+                        start = 0
+                        while True:
+                            end = find(b'\n', start)
+                            if end == -1:
+                                break
+                            if end > start:
+                                process_response(rxbuf[start:end].decode('utf-8'))
+                            start = end + 1
+                        if start:
+                            del rxbuf[:start]
+                            
+                # Write as much pending output as the socket accepts
+                if txbuf:
+                    try:
+                        sent = sock.send(txbuf)
+                        del txbuf[:sent]
+                    except BlockingIOError:
+                        pass
+                        
+                # Only wait for writability while output is pending
+                if bool(txbuf) != want_write:
+                    want_write = bool(txbuf)
+                    selector.modify(sock, selectors.EVENT_READ | selectors.EVENT_WRITE
+                                    if want_write else selectors.EVENT_READ)
                     
-                # Process received data
-                message = data.decode('utf-8')
-                self._process_response(message)
-                
-            except socket.timeout:
-                # Just a timeout, continue
-                continue
-                
-            except Exception as e:
-                if self.running:
-                    logger.error(f"Error receiving data: {str(e)}")
-                    self.disconnect()
-                break
+        except Exception as e:
+            if self.running and self.socket is sock:
+                logger.error(f"Error in socket I/O: {str(e)}")
+                self.disconnect()
                 
+        finally:
+            selector.close()
+            wakeup_reader.close()
+            wakeup_socket.close()
+            
     def _process_response(self, message: str) -> None:
         """
         Process a response message from the server
@@ -277,21 +519,21 @@ class MCPClient:
         """
         try:
             # Parse JSON response
-            response = json.loads(message)
+            response = _loads(message)
             
             # Get request ID if available
             request_id = response.get('requestId')
             
             if request_id:
+                # Resolve a waiting synchronous request first
+                future = self._pending.pop(request_id, None)
+                if future is not None and not future.done():
+                    future.set_result(response)
+                    
                 # Find and call the appropriate callback
                 callback = None
                 with self.response_lock:
-                    if request_id in self.callbacks:
-                        callback = self.callbacks[request_id]
-                        
-                        # Remove one-time callbacks (not sync callback)
-                        if callback != self._sync_response_callback:
-                            del self.callbacks[request_id]
+                    callback = self.callbacks.pop(request_id, None)
                             
                 if callback:
                     try:
@@ -299,6 +541,12 @@ class MCPClient:
                     except Exception as e:
                         logger.error(f"Error in callback for request {request_id}: {str(e)}")
                         
+            else:
+                # Authentication replies carry no request ID
+                future = self._auth_future
+                if future is not None and not future.done():
+                    future.set_result(response)
+                    
             # Call default callback if set
             if self.default_callback:
                 try:
@@ -312,16 +560,6 @@ class MCPClient:
         except Exception as e:
             logger.error(f"Error processing response: {str(e)}")
             
-    def _sync_response_callback(self, response: Dict[str, Any]) -> None:
-        """
-        Callback for synchronous command responses
-        
-        Args:
-            response: Response data
-        """
-        self.last_response = response
-        self.response_event.set()
-        
     def set_default_callback(self, callback: Callable) -> None:
         """
         Set a default callback for all responses
@@ -14,11 +14,33 @@ import logging
 import threading
 import time
 import uuid
+import hmac
+import queue
+import hashlib
 import argparse
+import functools
+import selectors
 import configparser
+from collections import OrderedDict
 from datetime import datetime
 from typing import Dict, List, Any, Union, Tuple, Optional
 
+# Use orjson for message (de)serialization when available; it encodes straight
+# to bytes
+try:
+    import orjson
+    _dumps = orjson.dumps
+    _loads = orjson.loads
+except ImportError:
+    orjson = None
+    _loads = json.loads
+
+    # Compact separators and raw UTF-8 match what orjson puts on the wire
+    _ENC = json.JSONEncoder(separators=(',', ':'), ensure_ascii=False).encode
+
+    def _dumps(obj: Any) -> bytes:
+        return _ENC(obj).encode('utf-8')
+
 # Configure logging
 logging.basicConfig(
     level=logging.INFO,
@@ -30,6 +52,166 @@ logging.basicConfig(
 )
 logger = logging.getLogger('MCPServer')
 
+# Seconds without any data before a connection is closed
+CLIENT_IDLE_TIMEOUT = 120
+
+# Seconds between sweeps of idle connections and expired cache entries
+HOUSEKEEPING_INTERVAL = 60
+
+# Size of each per-connection receive buffer
+RECV_BUFFER_SIZE = 8192
+
+# Kernel send/receive buffer size requested for each accepted socket
+SOCKET_BUFFER_SIZE = 64 * 1024
+
+# Largest newline-delimited message accepted from a connection
+MAX_MESSAGE_SIZE = 1 << 20
+
+# Unsent bytes allowed to pile up for a connection before it is closed
+MAX_SEND_BUFFER = 1 << 22
+
+def _token_digest(token: str) -> bytes:
+    """
+    Hash an auth token for constant-time comparison
+    
+    Args:
+        token: Authentication token
+        
+    Returns:
+        Token digest
+    """
+    return hashlib.blake2b(token.encode('utf-8'), digest_size=16).digest()
+
+def _encode_message(message: Dict[str, Any]) -> bytes:
+    """
+    Encode a message as newline-terminated JSON ready to send
+    
+    Args:
+        message: Message dictionary
+        
+    Returns:
+        Encoded message bytes
+    """
+    return _dumps(message) + b'\n'
+
+# Command messages made up only of these keys are forwarded to the EA as raw bytes
+_FORWARD_KEYS = frozenset(('command', 'requestId', 'parameters'))
+_FORWARD_KEY_BYTES = tuple(_dumps(key) for key in _FORWARD_KEYS)
+
+def _can_forward_raw(data: Dict[str, Any], message: bytes) -> bool:
+    """
+    Check whether a command's received bytes say exactly what was parsed
+    
+    The parser keeps the last of any duplicate key, but the EA would see
+    every copy. With no backslashes every key is spelled literally, so a
+    forwarded key appearing at most once in the bytes rules out duplicates.
+    
+    Args:
+        data: Parsed message
+        message: Message bytes the message was parsed from
+        
+    Returns:
+        True if the bytes can be forwarded to the EA unchanged
+    """
+    return (_FORWARD_KEYS.issuperset(data) and b'\\' not in message
+            and all(message.count(key) <= 1 for key in _FORWARD_KEY_BYTES))
+
+# Replies whose content never changes, encoded once
+_MSG_AUTHENTICATED = _encode_message({
+    'status': 'authenticated',
+    'message': 'Authentication successful'
+})
+_MSG_AUTH_FAILED = _encode_message({
+    'status': 'error',
+    'message': 'Authentication failed'
+})
+_MSG_NOT_AUTHENTICATED = _encode_message({
+    'status': 'error',
+    'message': 'Not authenticated'
+})
+_MSG_INVALID_JSON = _encode_message({
+    'status': 'error',
+    'message': 'Invalid JSON format'
+})
+
+
+class BufferPool:
+    """
+    LIFO pool of reusable receive buffers, so connections reuse memory
+    instead of allocating a new buffer for every read
+    """
+    def __init__(self, buffer_size: int = RECV_BUFFER_SIZE, max_buffers: int = 64) -> None:
+        """
+        Initialize the buffer pool
+        
+        Args:
+            buffer_size: Size of each buffer in bytes
+            max_buffers: Maximum number of idle buffers kept for reuse
+        """
+        self.buffer_size = buffer_size
+        self.max_buffers = max_buffers
+        self._buffers = []
+        self._lock = threading.Lock()
+        
+    def acquire(self) -> memoryview:
+        """
+        Take a buffer from the pool, allocating one if the pool is empty
+        
+        Returns:
+            Writable memoryview over the buffer
+        """
+        with self._lock:
+            if self._buffers:
+                return self._buffers.pop()
+        return memoryview(bytearray(self.buffer_size))
+        
+    def release(self, buffer: memoryview) -> None:
+        """
+        Return a buffer to the pool
+        
+        Args:
+            buffer: Buffer previously returned by acquire()
+        """
+        with self._lock:
+            if len(self._buffers) < self.max_buffers:
+                self._buffers.append(buffer)
+
+
+class ClientState:
+    """
+    Per-connection state for a client or the MetaTrader EA
+    
+    The buffers and last_activity are only written by the selector thread;
+    other threads may read a slightly stale last_activity, which is fine
+    for idle checks.
+    """
+    __slots__ = ('client_id', 'socket', 'address', 'type', 'authenticated',
+                 'last_activity', 'recv_buffer', 'rxbuf', 'txbuf', 'want_write')
+    
+    def __init__(self, client_id: str, client_socket: socket.socket, address: Tuple[str, int],
+                 authenticated: bool, recv_buffer: memoryview) -> None:
+        """
+        Initialize the state for a newly accepted connection
+        
+        Args:
+            client_id: Client identifier
+            client_socket: Socket object for client connection
+            address: Client address (IP, port)
+            authenticated: Whether the client starts out authenticated
+            recv_buffer: Pooled receive buffer for the connection
+        """
+        self.client_id = client_id
+        self.socket = client_socket
+        self.address = address
+        self.type = 'unknown'
+        self.authenticated = authenticated
+        self.last_activity = time.time()
+        self.recv_buffer = recv_buffer
+        self.rxbuf = bytearray()  # Bytes received but not yet framed into messages
+        self.txbuf = bytearray()  # Bytes queued for sending that the socket hasn't taken yet
+        self.want_write = False  # Whether the selector also waits for writability
+
+
 class MCPServer:
     """
     Main MCP Server class that handles socket connections from clients and the MetaTrader EA.
@@ -50,17 +232,25 @@ class MCPServer:
         self.auth_enabled = auth_enabled
         self.max_clients = max_clients
         self.server_socket = None
+        self.selector = None  # Selector multiplexing the listening and client sockets
         self.running = False
-        self.clients = {}  # Dictionary to store client connections
-        self.mt5_connection = None  # Connection to the MetaTrader EA
-        self.command_queue = []  # Queue of commands to be processed
-        self.response_cache = {}  # Cache of responses from MT5
+        self.clients = {}  # ClientState for each connection, keyed by client ID
+        self.mt5_connection = None  # ClientState of the MetaTrader EA connection
+        self.command_queue = queue.Queue()  # Queue of commands to be processed
+        self.response_cache = OrderedDict()  # Late responses from MT5, oldest first
+        self.pending = {}  # (event, response box) per request awaiting an MT5 response
+        self._outbox = queue.SimpleQueue()  # (state, payload, request_id) for the selector thread to send
+        self._wakeup_socket = None  # Written to wake the selector thread for sends
+        self._wakeup_reader = None
+        self._wakeup_pending = False
+        self.buffer_pool = BufferPool(RECV_BUFFER_SIZE, max_buffers=max_clients)
         self.auth_tokens = self._load_auth_tokens()  # Load auth tokens from config
+        self._token_digests = tuple(_token_digest(token) for token in self.auth_tokens)
         
         # Create locks for thread safety
         self.clients_lock = threading.Lock()
-        self.queue_lock = threading.Lock()
         self.cache_lock = threading.Lock()
+        self.pending_lock = threading.Lock()
         
         logger.info(f"MCP Server initialized with host={host}, port={port}")
         
@@ -81,7 +271,7 @@ class MCPServer:
                 if 'AUTH_TOKENS' in config:
                     for token, permissions in config['AUTH_TOKENS'].items():
                         tokens[token] = {
-                            'permissions': permissions.split(','),
+                            'permissions': frozenset(p.strip() for p in permissions.split(',')),
                             'created_at': datetime.now().isoformat()
                         }
                 logger.info(f"Loaded {len(tokens)} auth tokens from config")
@@ -91,7 +281,7 @@ class MCPServer:
             # Create default token if no config exists
             default_token = str(uuid.uuid4())
             tokens[default_token] = {
-                'permissions': ['all'],
+                'permissions': frozenset(('all',)),
                 'created_at': datetime.now().isoformat()
             }
             
@@ -115,7 +305,19 @@ class MCPServer:
             self.server_socket = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
             self.server_socket.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
             self.server_socket.bind((self.host, self.port))
-            self.server_socket.listen(self.max_clients)
+            # Backlog is independent of max_clients so bursts of reconnects are not dropped
+            self.server_socket.listen(socket.SOMAXCONN)
+            self.server_socket.setblocking(False)
+            
+            # All sockets are serviced from this thread through one selector
+            self.selector = selectors.DefaultSelector()
+            self.selector.register(self.server_socket, selectors.EVENT_READ, data=self._accept)
+            
+            # Other threads hand writes to the selector thread and wake it here
+            self._wakeup_reader, self._wakeup_socket = socket.socketpair()
+            self._wakeup_reader.setblocking(False)
+            self._wakeup_socket.setblocking(False)
+            self.selector.register(self._wakeup_reader, selectors.EVENT_READ, data=self._on_wakeup)
             self.running = True
             
             logger.info(f"MCP Server started on {self.host}:{self.port}")
@@ -125,19 +327,18 @@ class MCPServer:
             command_thread.daemon = True
             command_thread.start()
             
-            # Main server loop
+            # Start housekeeper thread for idle clients and the response cache
+            threading.Thread(target=self._housekeeper, daemon=True).start()
+            
+            # Main server loop: dispatch ready sockets to their handlers
+            selector = self.selector
             while self.running:
                 try:
-                    client_socket, address = self.server_socket.accept()
-                    client_thread = threading.Thread(
-                        target=self._handle_client,
-                        args=(client_socket, address)
-                    )
-                    client_thread.daemon = True
-                    client_thread.start()
+                    for key, events in selector.select(timeout=0.5):
+                        key.data(key.fileobj, events)
                 except Exception as e:
                     if self.running:
-                        logger.error(f"Error accepting connection: {str(e)}")
+                        logger.error(f"Error in server loop: {str(e)}")
                         time.sleep(0.1)
                         
         except Exception as e:
@@ -155,7 +356,7 @@ class MCPServer:
         with self.clients_lock:
             for client_id, client_info in self.clients.items():
                 try:
-                    client_info['socket'].close()
+                    client_info.socket.close()
                 except:
                     pass
             self.clients.clear()
@@ -163,7 +364,7 @@ class MCPServer:
         # Close MetaTrader connection if exists
         if self.mt5_connection:
             try:
-                self.mt5_connection.close()
+                self.mt5_connection.socket.close()
             except:
                 pass
             self.mt5_connection = None
@@ -176,135 +377,250 @@ class MCPServer:
                 pass
             self.server_socket = None
             
+        # Close wakeup sockets
+        for wakeup in (self._wakeup_socket, self._wakeup_reader):
+            if wakeup:
+                try:
+                    wakeup.close()
+                except:
+                    pass
+                    
+        # Close selector
+        if self.selector:
+            try:
+                self.selector.close()
+            except:
+                pass
+            self.selector = None
+            
         logger.info("MCP Server stopped")
         
-    def _handle_client(self, client_socket: socket.socket, address: Tuple[str, int]) -> None:
+    def _accept(self, server_socket: socket.socket, events: int) -> None:
         """
-        Handle client connection and process incoming messages
+        Accept every pending connection and register each with the selector
+        
+        Draining the backlog here means a burst of connections costs one
+        selector wakeup rather than one per connection.
+        
+        Args:
+            server_socket: Listening socket reported readable by the selector
+            events: Ready events reported by the selector
+        """
+        while True:
+            try:
+                client_socket, address = server_socket.accept()
+            except (BlockingIOError, InterruptedError):
+                return
+            except OSError as e:
+                # e.g. EMFILE; leave remaining connections for the next wakeup
+                logger.error(f"Error accepting connection: {str(e)}")
+                return
+                
+            self._add_client(client_socket, address)
+            
+    def _add_client(self, client_socket: socket.socket, address: Tuple[str, int]) -> None:
+        """
+        Configure a newly accepted socket and register it with the selector
         
         Args:
             client_socket: Socket object for client connection
             address: Client address (IP, port)
         """
         client_id = str(uuid.uuid4())
-        client_type = 'unknown'
-        authenticated = not self.auth_enabled
-        
         logger.info(f"New connection from {address[0]}:{address[1]}, assigned ID: {client_id}")
         
         try:
-            # Set socket timeout
-            client_socket.settimeout(60)
+            # All I/O goes through the selector; output the socket can't take
+            # yet waits in the connection's txbuf
+            client_socket.setblocking(False)
+            
+            # Small JSON messages must go out immediately, not wait on Nagle
+            client_socket.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+            client_socket.setsockopt(socket.SOL_SOCKET, socket.SO_RCVBUF, SOCKET_BUFFER_SIZE)
+            client_socket.setsockopt(socket.SOL_SOCKET, socket.SO_SNDBUF, SOCKET_BUFFER_SIZE)
             
             # Add to clients dictionary
+            state = ClientState(client_id, client_socket, address,
+                                not self.auth_enabled, self.buffer_pool.acquire())
             with self.clients_lock:
-                self.clients[client_id] = {
-                    'socket': client_socket,
-                    'address': address,
-                    'type': client_type,
-                    'authenticated': authenticated,
-                    'last_activity': time.time()
-                }
-            
-            # Receive data from client
-            buffer_size = 4096
-            while self.running:
-                try:
-                    data = client_socket.recv(buffer_size)
-                    if not data:
-                        logger.info(f"Client {client_id} disconnected")
-                        break
-                    
-                    # Update last activity time
-                    with self.clients_lock:
-                        if client_id in self.clients:
-                            self.clients[client_id]['last_activity'] = time.time()
-                    
-                    # Process received data
-                    message = data.decode('utf-8')
-                    self._process_message(client_id, message)
-                    
-                except socket.timeout:
-                    # Check if client is still active
-                    with self.clients_lock:
-                        if client_id in self.clients:
-                            if time.time() - self.clients[client_id]['last_activity'] > 120:
-                                logger.info(f"Client {client_id} timed out")
-                                break
-                            
-                except Exception as e:
-                    logger.error(f"Error receiving data from client {client_id}: {str(e)}")
-                    break
-                    
+                self.clients[client_id] = state
+            
+            self.selector.register(client_socket, selectors.EVENT_READ,
+                                   data=functools.partial(self._on_event, state))
+            
         except Exception as e:
             logger.error(f"Error handling client {client_id}: {str(e)}")
+            self._close_client(client_id, client_socket)
             
-        finally:
-            # Close connection and remove from clients
+    def _on_event(self, state: ClientState, client_socket: socket.socket, events: int) -> None:
+        """
+        Service a client socket reported ready by the selector
+        
+        Args:
+            state: The connection's client state
+            client_socket: Socket object for client connection
+            events: Ready events reported by the selector
+        """
+        if events & selectors.EVENT_WRITE and not self._flush(state):
+            return
+        if events & selectors.EVENT_READ:
+            self._on_read(state, client_socket)
+            
+    def _on_wakeup(self, wakeup_reader: socket.socket, events: int) -> None:
+        """
+        Send the payloads other threads queued with _post
+        
+        A command that can't be written to the EA is failed right away
+        rather than left to time out.
+        
+        Args:
+            wakeup_reader: Read end of the wakeup socket pair
+            events: Ready events reported by the selector
+        """
+        # Consume the wakeup before clearing the flag, and clear it before
+        # draining, so no queued payload is missed
+        try:
+            wakeup_reader.recv(4096)
+        except BlockingIOError:
+            pass
+        self._wakeup_pending = False
+        
+        outbox = self._outbox
+        while True:
             try:
-                client_socket.close()
-            except:
-                pass
+                state, payload, request_id = outbox.get_nowait()
+            except queue.Empty:
+                break
+            if not self._write(state, payload) and request_id is not None:
+                self._fail_pending("Failed to send command to MetaTrader EA", request_id)
+            
+    def _on_read(self, state: ClientState, client_socket: socket.socket) -> None:
+        """
+        Receive data from a client socket reported readable by the selector
+        
+        Messages are newline-delimited JSON. Received bytes are accumulated in
+        the connection's rxbuf until a full message is available, so messages
+        split across reads or coalesced into a single read are both handled.
+        
+        Args:
+            state: The connection's client state
+            client_socket: Socket object for client connection
+        """
+        client_id = state.client_id
+        recv_buffer = state.recv_buffer
+        rxbuf = state.rxbuf
+        try:
+            nbytes = client_socket.recv_into(recv_buffer)
+        except (BlockingIOError, InterruptedError):
+            return
+        except Exception as e:
+            logger.error(f"Error receiving data from client {client_id}: {str(e)}")
+            self._close_client(client_id, client_socket)
+            return
+            
+        if not nbytes:
+            logger.info(f"Client {client_id} disconnected")
+            self._close_client(client_id, client_socket)
+            return
+            
+        # Update last activity time (only this thread writes it)
+        state.last_activity = time.time()
                 
-            with self.clients_lock:
-                if client_id in self.clients:
-                    del self.clients[client_id]
-                    
-            logger.info(f"Connection closed for client {client_id}")
+        # Process every complete message in the buffer, then send all the
+        # replies they produced at once
+        rxbuf.extend(recv_buffer[:nbytes])
+        replies = []
+        start = 0
+        while True:
+            end = rxbuf.find(b'\n', start)
+            if end == -1:
+                break
+            if end > start:
+                self._process_message(state, rxbuf[start:end], replies)
+            start = end + 1
+        if start:
+            del rxbuf[:start]
+            
+        if replies and not self._send_many(state, replies):
+            return
             
-    def _process_message(self, client_id: str, message: str) -> None:
+        if len(rxbuf) > MAX_MESSAGE_SIZE:
+            logger.error(f"Message from client {client_id} exceeds {MAX_MESSAGE_SIZE} bytes")
+            self._close_client(client_id, client_socket)
+                
+    def _close_client(self, client_id: str, client_socket: socket.socket) -> None:
         """
-        Process message received from client
+        Unregister and close a client connection and remove it from clients
         
         Args:
             client_id: Client identifier
-            message: Message received from client
+            client_socket: Socket object for client connection
         """
+        try:
+            self.selector.unregister(client_socket)
+        except Exception:
+            pass
+            
+        try:
+            client_socket.close()
+        except:
+            pass
+            
+        with self.clients_lock:
+            client = self.clients.pop(client_id, None)
+            
+        if client is not None:
+            self.buffer_pool.release(client.recv_buffer)
+            if client is self.mt5_connection:
+                self.mt5_connection = None
+                self._fail_pending("MetaTrader EA disconnected")
+            
+        logger.info(f"Connection closed for client {client_id}")
+            
+    def _process_message(self, state: ClientState, message: bytes, replies: List[bytes]) -> None:
+        """
+        Process message received from client
+        
+        Args:
+            state: The sending connection's client state
+            message: Message received from client (UTF-8 JSON, without delimiter)
+            replies: List to append encoded replies to; the caller sends them
+        """
+        client_id = state.client_id
         try:
             # Parse JSON message
-            data = json.loads(message)
+            data = _loads(message)
             
             # Check if identification message (from MT5 EA)
             if 'identity' in data and data['identity'] == 'MT5_EA':
-                with self.clients_lock:
-                    if client_id in self.clients:
-                        self.clients[client_id]['type'] = 'mt5_ea'
-                        self.mt5_connection = self.clients[client_id]['socket']
-                        
-                        # Send acknowledgment
-                        self._send_to_client(client_id, json.dumps({
-                            'status': 'connected',
-                            'server_time': datetime.now().isoformat()
-                        }))
-                        
-                        logger.info(f"Client {client_id} identified as MT5 EA")
-                        return
+                state.type = 'mt5_ea'
+                self.mt5_connection = state
+                
+                # Send acknowledgment
+                replies.append(_encode_message({
+                    'status': 'connected',
+                    'server_time': time.time_ns() // 1_000_000  # Epoch milliseconds
+                }))
+                
+                logger.info(f"Client {client_id} identified as MT5 EA")
+                return
                         
             # Check if authentication message
-            if 'auth' in data and not self._is_client_authenticated(client_id):
+            if 'auth' in data and not state.authenticated:
                 auth_token = data['auth']
-                if self._authenticate_client(client_id, auth_token):
+                if self._authenticate_client(state, auth_token):
                     # Send successful authentication response
-                    self._send_to_client(client_id, json.dumps({
-                        'status': 'authenticated',
-                        'message': 'Authentication successful'
-                    }))
+                    replies.append(_MSG_AUTHENTICATED)
                     logger.info(f"Client {client_id} authenticated successfully")
                 else:
                     # Send authentication failure response
-                    self._send_to_client(client_id, json.dumps({
-                        'status': 'error',
-                        'message': 'Authentication failed'
-                    }))
+                    replies.append(_MSG_AUTH_FAILED)
                     logger.warning(f"Authentication failed for client {client_id}")
                 return
                 
             # Check if client is authenticated for command processing
-            if not self._is_client_authenticated(client_id):
-                self._send_to_client(client_id, json.dumps({
-                    'status': 'error',
-                    'message': 'Not authenticated'
-                }))
+            if not state.authenticated:
+                replies.append(_MSG_NOT_AUTHENTICATED)
                 logger.warning(f"Unauthenticated command attempt from client {client_id}")
                 return
                 
@@ -315,33 +631,51 @@ class MCPServer:
                 parameters = data.get('parameters', {})
                 
                 # Handle command processing based on client type
-                client_type = self._get_client_type(client_id)
-                
-                if client_type == 'mt5_ea':
+                if state.type == 'mt5_ea':
                     # Handle response from MT5 EA
                     if 'responseToId' in data:
                         response_to = data['responseToId']
-                        with self.cache_lock:
-                            self.response_cache[response_to] = {
-                                'data': data,
-                                'timestamp': time.time()
-                            }
-                            logger.debug(f"Cached response for request {response_to}")
+                        
+                        # Hand the response to the command waiting for it
+                        with self.pending_lock:
+                            waiter = self.pending.pop(response_to, None)
+                            if waiter:
+                                waiter[1].append(data)
+                                
+                        if waiter:
+                            waiter[0].set()
+                        else:
+                            # Nothing is waiting (e.g. the command timed out)
+                            with self.cache_lock:
+                                self.response_cache[response_to] = (time.time(), data)
+                                self.response_cache.move_to_end(response_to)
+                                logger.debug("Cached response for request %s", response_to)
                     
                 else:
+                    # If the message's bytes carry exactly the forwarded fields, keep
+                    # them minus the closing brace and splice in any missing
+                    # fields; _execute_command appends the timestamp
+                    raw = None
+                    if _can_forward_raw(data, message):
+                        raw = bytes(message).rstrip()[:-1]
+                        if 'requestId' not in data:
+                            raw += b',"requestId":' + _dumps(request_id)
+                        if 'parameters' not in data:
+                            raw += b',"parameters":{}'
+                            
                     # Add command to processing queue
-                    with self.queue_lock:
-                        self.command_queue.append({
-                            'client_id': client_id,
-                            'command': command,
-                            'parameters': parameters,
-                            'request_id': request_id,
-                            'timestamp': time.time()
-                        })
-                        logger.debug(f"Added command '{command}' to queue (request_id: {request_id})")
+                    self.command_queue.put({
+                        'state': state,
+                        'command': command,
+                        'parameters': parameters,
+                        'request_id': request_id,
+                        'raw': raw,
+                        'timestamp': time.time()
+                    })
+                    logger.debug("Added command '%s' to queue (request_id: %s)", command, request_id)
                     
                     # Send acknowledgment to client
-                    self._send_to_client(client_id, json.dumps({
+                    replies.append(_encode_message({
                         'status': 'queued',
                         'requestId': request_id,
                         'message': f"Command '{command}' queued for processing"
@@ -349,10 +683,7 @@ class MCPServer:
                     
         except json.JSONDecodeError:
             logger.error(f"Invalid JSON received from client {client_id}")
-            self._send_to_client(client_id, json.dumps({
-                'status': 'error',
-                'message': 'Invalid JSON format'
-            }))
+            replies.append(_MSG_INVALID_JSON)
             
         except Exception as e:
             logger.error(f"Error processing message from client {client_id}: {str(e)}")
@@ -363,18 +694,13 @@ class MCPServer:
         """
         while self.running:
             try:
-                command_item = None
-                
-                # Get next command from queue
-                with self.queue_lock:
-                    if self.command_queue:
-                        command_item = self.command_queue.pop(0)
-                
-                if command_item:
-                    self._execute_command(command_item)
-                else:
-                    # No commands to process, sleep a bit
-                    time.sleep(0.1)
+                # Block until a command arrives, waking periodically to check running
+                try:
+                    command_item = self.command_queue.get(timeout=0.5)
+                except queue.Empty:
+                    continue
+                    
+                self._execute_command(command_item)
                     
             except Exception as e:
                 logger.error(f"Error in command processing thread: {str(e)}")
@@ -387,119 +713,209 @@ class MCPServer:
         Args:
             command_item: Command information dictionary
         """
-        client_id = command_item['client_id']
+        state = command_item['state']
         command = command_item['command']
         parameters = command_item['parameters']
         request_id = command_item['request_id']
         
         logger.info(f"Executing command '{command}' (request_id: {request_id})")
         
-        # Check if MT5 EA is connected
-        if not self.mt5_connection:
+        # Check if MT5 EA is connected (snapshot, as the selector thread may replace it)
+        ea = self.mt5_connection
+        if ea is None:
             error_msg = "MetaTrader EA not connected"
             logger.error(f"{error_msg} - cannot execute command '{command}'")
-            self._send_to_client(client_id, json.dumps({
+            self._post(state, _encode_message({
                 'status': 'error',
                 'requestId': request_id,
                 'message': error_msg
             }))
             return
             
+        # Register for the response before sending so it cannot be missed
+        response_event = threading.Event()
+        response_box = []
+        with self.pending_lock:
+            self.pending[request_id] = (response_event, response_box)
+            
         try:
             # Forward command to MT5 EA
-            mt5_message = json.dumps({
-                'command': command,
-                'parameters': parameters,
-                'requestId': request_id,
-                'timestamp': datetime.now().isoformat()
-            })
+            timestamp = time.time_ns() // 1_000_000  # Epoch milliseconds
+            raw = command_item['raw']
+            if raw is not None:
+                mt5_message = raw + b',"timestamp":%d}\n' % timestamp
+            else:
+                mt5_message = _encode_message({
+                    'command': command,
+                    'parameters': parameters,
+                    'requestId': request_id,
+                    'timestamp': timestamp
+                })
             
-            self.mt5_connection.sendall(mt5_message.encode('utf-8'))
-            logger.debug(f"Command '{command}' sent to MT5 EA")
+            # The selector thread does all writes to the EA, like to any client,
+            # and fails the pending request if the write doesn't go through
+            self._post(ea, mt5_message, request_id)
+            logger.debug("Command '%s' sent to MT5 EA", command)
             
             # Wait for response with timeout
             max_wait_time = 30  # seconds
-            start_time = time.time()
-            
-            while time.time() - start_time < max_wait_time:
-                # Check if response is in cache
-                with self.cache_lock:
-                    if request_id in self.response_cache:
-                        response_data = self.response_cache[request_id]['data']
-                        del self.response_cache[request_id]
-                        
-                        # Forward response to client
-                        self._send_to_client(client_id, json.dumps(response_data))
-                        logger.debug(f"Response for request {request_id} forwarded to client")
-                        return
-                        
-                # Sleep a bit before checking again
-                time.sleep(0.1)
+            if not response_event.wait(max_wait_time):
+                # The response may have been delivered just as the wait expired
+                with self.pending_lock:
+                    self.pending.pop(request_id, None)
+                    
+            if response_box:
+                # Forward response to client
+                self._post(state, _encode_message(response_box[0]))
+                logger.debug("Response for request %s forwarded to client", request_id)
+                return
                 
             # Timeout occurred
             logger.warning(f"Timeout waiting for response to command '{command}' (request_id: {request_id})")
-            self._send_to_client(client_id, json.dumps({
+            self._post(state, _encode_message({
                 'status': 'error',
                 'requestId': request_id,
                 'message': 'Timeout waiting for response from MetaTrader'
             }))
             
         except Exception as e:
+            with self.pending_lock:
+                self.pending.pop(request_id, None)
+                
             logger.error(f"Error executing command '{command}': {str(e)}")
-            self._send_to_client(client_id, json.dumps({
+            self._post(state, _encode_message({
                 'status': 'error',
                 'requestId': request_id,
                 'message': f"Error executing command: {str(e)}"
             }))
             
-    def _send_to_client(self, client_id: str, message: str) -> bool:
+    def _write(self, state: ClientState, payload: bytes) -> bool:
         """
-        Send message to a specific client
+        Queue data on a connection and send as much as the socket takes now
+        
+        Only the selector thread may call this, as it owns every txbuf;
+        other threads use _post. A connection that lets more than
+        MAX_SEND_BUFFER bytes pile up is closed rather than buffered forever.
         
         Args:
-            client_id: Client identifier
-            message: Message to send
+            state: The connection's client state
+            payload: Encoded, newline-terminated message(s) to send
             
         Returns:
-            True if successful, False otherwise
+            True if the connection is still open, False otherwise
         """
-        try:
-            with self.clients_lock:
-                if client_id in self.clients:
-                    client_socket = self.clients[client_id]['socket']
-                    client_socket.sendall(message.encode('utf-8'))
-                    return True
-                else:
-                    logger.warning(f"Attempted to send message to non-existent client {client_id}")
+        # A closed socket means the client disconnected while its command ran
+        if state.socket.fileno() == -1:
+            logger.warning(f"Attempted to send message to disconnected client {state.client_id}")
             return False
-        except Exception as e:
-            logger.error(f"Error sending message to client {client_id}: {str(e)}")
+            
+        state.txbuf += payload
+        if len(state.txbuf) > MAX_SEND_BUFFER:
+            logger.error(f"Client {state.client_id} has over {MAX_SEND_BUFFER} unsent bytes, closing")
+            self._close_client(state.client_id, state.socket)
             return False
             
-    def _is_client_authenticated(self, client_id: str) -> bool:
+        return self._flush(state)
+        
+    def _flush(self, state: ClientState) -> bool:
         """
-        Check if client is authenticated
+        Send as much of a connection's txbuf as the socket accepts
         
         Args:
-            client_id: Client identifier
+            state: The connection's client state
             
         Returns:
-            True if authenticated or auth disabled, False otherwise
+            True if the connection is still open, False otherwise
         """
-        if not self.auth_enabled:
-            return True
+        txbuf = state.txbuf
+        if txbuf:
+            try:
+                sent = state.socket.send(txbuf)
+            except (BlockingIOError, InterruptedError):
+                sent = 0
+            except Exception as e:
+                # Part of a message may be out already, so the stream can't be resumed
+                logger.error(f"Error sending message to client {state.client_id}: {str(e)}")
+                self._close_client(state.client_id, state.socket)
+                return False
+            del txbuf[:sent]
             
-        with self.clients_lock:
-            if client_id in self.clients:
-                return self.clients[client_id]['authenticated']
-        return False
+        # Only wait for writability while output is pending
+        want_write = bool(txbuf)
+        if want_write != state.want_write:
+            state.want_write = want_write
+            client_socket = state.socket
+            self.selector.modify(client_socket,
+                                 selectors.EVENT_READ | selectors.EVENT_WRITE
+                                 if want_write else selectors.EVENT_READ,
+                                 self.selector.get_key(client_socket).data)
+        return True
         
-    def _authenticate_client(self, client_id: str, token: str) -> bool:
+    def _post(self, state: ClientState, payload: bytes, request_id: Optional[str] = None) -> None:
+        """
+        Hand data for a connection to the selector thread to send
+        
+        Args:
+            state: The connection's client state
+            payload: Encoded, newline-terminated message to send
+            request_id: Pending request to fail if the payload can't be sent
+        """
+        self._outbox.put((state, payload, request_id))
+        
+        # Wake the selector thread unless a wakeup is already in flight
+        if not self._wakeup_pending:
+            self._wakeup_pending = True
+            try:
+                self._wakeup_socket.send(b'\0')
+            except OSError:
+                # Wakeup socket full (a wakeup is pending anyway) or closed by stop()
+                pass
+                
+    def _fail_pending(self, reason: str, request_id: Optional[str] = None) -> None:
+        """
+        Resolve commands waiting on the EA with an error instead of a timeout
+        
+        Args:
+            reason: Why the command failed
+            request_id: Request to fail, or None to fail every waiting request
+        """
+        with self.pending_lock:
+            if request_id is None:
+                waiters = list(self.pending.items())
+                self.pending.clear()
+            else:
+                waiter = self.pending.pop(request_id, None)
+                waiters = [(request_id, waiter)] if waiter else []
+                
+        for waiting_id, (event, box) in waiters:
+            box.append({
+                'status': 'error',
+                'requestId': waiting_id,
+                'message': f"Error executing command: {reason}"
+            })
+            event.set()
+            
+    def _send_many(self, state: ClientState, messages: List[bytes]) -> bool:
+        """
+        Send several messages to a connection with a single send call
+        
+        Args:
+            state: The connection's client state
+            messages: Encoded, newline-terminated messages to send
+            
+        Returns:
+            True if the connection is still open, False otherwise
+        """
+        if len(messages) == 1:
+            return self._write(state, messages[0])
+        return self._write(state, b''.join(messages))
+        
+    def _authenticate_client(self, state: ClientState, token: str) -> bool:
         """
         Authenticate a client using the provided token
         
         Args:
-            client_id: Client identifier
+            state: The client's state
             token: Authentication token
             
         Returns:
@@ -508,46 +924,66 @@ class MCPServer:
         if not self.auth_enabled:
             return True
             
-        if token in self.auth_tokens:
-            with self.clients_lock:
-                if client_id in self.clients:
-                    self.clients[client_id]['authenticated'] = True
-                    return True
-                    
-        return False
+        if not isinstance(token, str):
+            return False
+            
+        # Compare against every known token so timing doesn't reveal a match
+        digest = _token_digest(token)
+        valid = False
+        for token_digest in self._token_digests:
+            valid |= hmac.compare_digest(digest, token_digest)
+            
+        if valid:
+            state.authenticated = True
+            
+        return valid
         
-    def _get_client_type(self, client_id: str) -> str:
+    def _housekeeper(self) -> None:
+        """
+        Periodically close idle clients and expire cached responses
+        """
+        while self.running:
+            time.sleep(HOUSEKEEPING_INTERVAL)
+            try:
+                self._clean_expired_cache()
+                self._sweep_idle_clients()
+            except Exception as e:
+                logger.error(f"Error in housekeeper: {str(e)}")
+                
+    def _sweep_idle_clients(self) -> None:
         """
-        Get client type
+        Shut down connections that have been idle longer than CLIENT_IDLE_TIMEOUT
         
-        Args:
-            client_id: Client identifier
-            
-        Returns:
-            Client type ('mt5_ea', 'client', or 'unknown')
+        The socket is only shut down here; the selector thread then sees
+        end-of-stream and closes and unregisters it as for any other peer.
         """
+        cutoff = time.time() - CLIENT_IDLE_TIMEOUT
         with self.clients_lock:
-            if client_id in self.clients:
-                return self.clients[client_id].get('type', 'unknown')
-        return 'unknown'
-        
+            idle = [state for state in self.clients.values() if state.last_activity < cutoff]
+            
+        for state in idle:
+            logger.info(f"Client {state.client_id} timed out")
+            try:
+                state.socket.shutdown(socket.SHUT_RDWR)
+            except OSError:
+                pass
+                
     def _clean_expired_cache(self) -> None:
         """
         Clean expired items from response cache
         """
-        current_time = time.time()
-        expired_keys = []
+        cutoff = time.time() - 600  # 10 minutes expiration
+        expired_count = 0
         
+        # Entries are kept in insertion order, so stop at the first live one
         with self.cache_lock:
-            for key, value in self.response_cache.items():
-                if current_time - value['timestamp'] > 600:  # 10 minutes expiration
-                    expired_keys.append(key)
-                    
-            for key in expired_keys:
-                del self.response_cache[key]
+            cache = self.response_cache
+            while cache and next(iter(cache.values()))[0] < cutoff:
+                cache.popitem(last=False)
+                expired_count += 1
                 
-        if expired_keys:
-            logger.debug(f"Cleaned {len(expired_keys)} expired cache entries")
+        if expired_count:
+            logger.debug("Cleaned %d expired cache entries", expired_count)
 
 
 def parse_arguments():